@@ -2,9 +2,22 @@
 import os
 import argparse
 import fnmatch
+import functools
+import hashlib
 import logging
+import re
+import shutil
+import sqlite3
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+try:
+    import pathspec
+except ImportError:  # pathspec is optional; fall back to fnmatch-style matching
+    pathspec = None
+
 #SECTION: Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -13,16 +26,78 @@ class FileProcessingError(Exception):
     pass
 
 #SECTION: File Reading Function
+# Reads never need atime updates; O_NOATIME only exists on Linux
+_NOATIME_FLAG = getattr(os, 'O_NOATIME', 0)
+
+def _open_for_read(file_path):
+    """Open a file descriptor for reading, skipping atime updates where allowed."""
+    if _NOATIME_FLAG:
+        try:
+            return os.open(file_path, os.O_RDONLY | _NOATIME_FLAG)
+        except PermissionError:
+            # O_NOATIME is refused on files the caller does not own
+            pass
+    return os.open(file_path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+
 def read_file_content(file_path):
-    """Read and return the content of a file."""
+    """Read and return the raw bytes of a file."""
     try:
-        with open(file_path, 'r') as file:
-            return file.read()
+        fd = _open_for_read(file_path)
+        try:
+            # Ask for one byte past the fstat size, so a small file is read and shown not
+            # to have grown in a single call. A short read only counts as EOF once the
+            # total reaches that size: read(2) also returns short counts for files over
+            # ~2 GiB and may do so on NFS/FUSE. Files that grew are read to an empty read.
+            size = os.fstat(fd).st_size
+            chunks = []
+            total = 0
+            while True:
+                request = size + 1 - total if total <= size else 1 << 16
+                chunk = os.read(fd, request)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                total += len(chunk)
+                if total >= size and len(chunk) < request:
+                    break
+            content = chunks[0] if len(chunks) == 1 else b''.join(chunks)
+        finally:
+            os.close(fd)
     except IOError as e:
         logging.error(f"Error reading file {file_path}: {e}")
         raise FileProcessingError(f"Unable to read file: {file_path}")
+    return content
+
+def _safe_read(file_path):
+    """
+    Read a file for the worker pool without letting errors escape the map.
+    
+    Args:
+    file_path (str): The path of the file to read.
+    
+    Returns:
+    tuple: (file_path, content), where content is None if the file could not be read.
+    """
+    try:
+        return file_path, read_file_content(file_path)
+    except FileProcessingError:
+        return file_path, None
+
+def is_binary_content(content):
+    """
+    Check whether file content looks binary, using the same NUL-byte heuristic as git.
+    
+    Args:
+    content (bytes): The raw file content.
+    
+    Returns:
+    bool: True if a NUL byte appears in the first 8000 bytes, False otherwise.
+    """
+    return b'\0' in content[:8000]
 
 #SECTION: Gitignore Handling
+_GLOB_CHARS = re.compile(r'[*?[]')
+
 def parse_gitignore(directory):
     """
     Parse .gitignore file and return a list of patterns.
@@ -43,8 +118,121 @@ def parse_gitignore(directory):
                     patterns.append(line)
     return patterns
 
+def compile_ignore_patterns(patterns):
+    """
+    Compile gitignore patterns into a single regular expression.
+    
+    Args:
+    patterns (list): A list of glob patterns, typically from parse_gitignore.
+    
+    Returns:
+    re.Pattern: A regex matching any of the patterns, or None if there are no patterns.
+    """
+    if not patterns:
+        return None
+    return re.compile('|'.join(f'(?:{fnmatch.translate(os.path.normcase(pattern))})'
+                               for pattern in patterns))
+
+def build_ignore_matcher(patterns):
+    """
+    Build a predicate that tells whether a relative path is ignored.
+    
+    Uses pathspec's gitignore semantics (negation, anchoring, directory-only
+    patterns) when it is installed, and precompiled fnmatch patterns otherwise.
+    
+    Args:
+    patterns (list): A list of patterns, typically from parse_gitignore.
+    
+    Returns:
+    callable: A function taking a relative path (directories end with a separator) and
+    returning True if it is ignored, False if a negated pattern re-includes it, or None
+    if no pattern matches; None instead of a function if there are no patterns.
+    """
+    if not patterns:
+        return None
+    if pathspec is not None:
+        spec = pathspec.GitIgnoreSpec.from_lines(patterns)
+        return lambda rel_path: spec.check_file(rel_path).include
+
+    # Bucket the patterns so the common cases skip the regex engine entirely:
+    # '*.ext' becomes a suffix test, glob-free patterns become a set lookup, and
+    # glob-free directory-only patterns ('node_modules/') are kept without the slash
+    suffixes = []
+    literals = set()
+    dir_literals = set()
+    generic = []
+    for pattern in patterns:
+        pattern = os.path.normcase(pattern)
+        if pattern.startswith('*.') and not _GLOB_CHARS.search(pattern, 1):
+            suffixes.append(pattern[1:])
+        elif not _GLOB_CHARS.search(pattern):
+            if pattern.endswith(os.sep):
+                dir_literals.add(pattern.rstrip(os.sep))
+            else:
+                literals.add(pattern)
+        else:
+            generic.append(pattern)
+    suffixes = tuple(suffixes)
+    ignore_regex = compile_ignore_patterns(generic)
+
+    # Basenames repeat heavily across a tree, so their verdicts are memoized
+    @functools.lru_cache(maxsize=None)
+    def is_basename_ignored(name):
+        return bool(ignore_regex.match(name))
+
+    def matches(rel_path):
+        rel_path = os.path.normcase(rel_path)
+        if rel_path.endswith(os.sep):
+            # Directories match directory-only patterns by name or path, then everything else
+            rel_path = rel_path[:-1]
+            if os.path.basename(rel_path) in dir_literals or rel_path in dir_literals:
+                return True
+            return matches(rel_path)
+        name = os.path.basename(rel_path)
+        if suffixes and name.endswith(suffixes):
+            return True
+        if name in literals or rel_path in literals:
+            return True
+        if ignore_regex is not None and (is_basename_ignored(name) or ignore_regex.match(rel_path)):
+            return True
+        return None  # fnmatch has no negation, so a file is never explicitly re-included
+
+    return matches
+
+def load_ignore_matcher(directory):
+    """
+    Parse and compile the .gitignore of a directory.
+    
+    Args:
+    directory (str): The directory that may contain a .gitignore file.
+    
+    Returns:
+    callable: A matcher as returned by build_ignore_matcher, or None if there are no patterns.
+    """
+    return build_ignore_matcher(parse_gitignore(directory))
+
 #SECTION: File Collection Function
-def collect_files(directory, recursive=False, ignore_patterns=None):
+# Extensions of files that are never embedded, so they are skipped before any read
+BINARY_EXTENSIONS = frozenset({
+    'png', 'jpg', 'jpeg', 'gif', 'bmp', 'ico', 'webp',
+    'pdf', 'zip', 'tar', 'gz', 'bz2', 'xz', '7z', 'jar',
+    'so', 'dll', 'exe', 'bin', 'o', 'a', 'pyc',
+    'woff', 'woff2', 'ttf', 'otf', 'eot',
+})
+
+def is_binary_filename(filename):
+    """
+    Check whether a filename has a known binary extension.
+    
+    Args:
+    filename (str): The name of the file.
+    
+    Returns:
+    bool: True if the file extension is in BINARY_EXTENSIONS, False otherwise.
+    """
+    return os.path.splitext(filename)[1][1:].lower() in BINARY_EXTENSIONS
+
+def collect_files(directory, recursive=False, ignore_patterns=None, nested_gitignore=False):
     """
     Collect files from the given directory, respecting .gitignore if provided.
     
@@ -52,41 +240,90 @@ def collect_files(directory, recursive=False, ignore_patterns=None):
     directory (str): The directory to collect files from.
     recursive (bool): Whether to recursively collect files from subdirectories.
     ignore_patterns (list): List of patterns to ignore, typically from .gitignore.
+    nested_gitignore (bool): Whether to also apply .gitignore files found in subdirectories.
     
     Returns:
-    generator: A generator yielding file paths that are not ignored.
+    generator: A generator yielding file paths that are not ignored and not known binaries.
     """
-    def is_ignored(file_path):
+    ignore_matcher = build_ignore_matcher(ignore_patterns)
+    root_matchers = () if ignore_matcher is None else ((0, ignore_matcher),)
+
+    def is_ignored(rel_path, matchers):
         """
-        Check if a file should be ignored based on .gitignore patterns.
+        Check if a path should be ignored based on .gitignore patterns.
         
         Args:
-        file_path (str): The path of the file to check.
+        rel_path (str): The path relative to the collected directory; directories end with a separator.
+        matchers (tuple): (offset, matcher) pairs, where offset is the length of the relative
+            prefix of the directory whose .gitignore the matcher was built from.
         
         Returns:
-        bool: True if the file should be ignored, False otherwise.
+        bool: True if the path should be ignored, False otherwise.
         """
-        if not ignore_patterns:
-            return False
-        
-        rel_path = os.path.relpath(file_path, directory)
-        return any(fnmatch.fnmatch(rel_path, pattern) or 
-                   fnmatch.fnmatch(os.path.basename(rel_path), pattern) 
-                   for pattern in ignore_patterns)
+        # As in git, the deepest .gitignore with a matching rule decides, so a nested
+        # '!pattern' can re-include a file that a parent directory's patterns ignore
+        for offset, matcher in reversed(matchers):
+            verdict = matcher(rel_path[offset:])
+            if verdict is not None:
+                return verdict
+        return False
 
     if recursive:
-        for root, _, files in os.walk(directory):
-            for file in files:
-                file_path = os.path.join(root, file)
-                if not is_ignored(file_path):
-                    yield file_path
+        # Walk with an explicit stack of (path, relative prefix, matchers) entries so each
+        # DirEntry's cached type is reused and relative paths are built without os.path.relpath
+        pending_dirs = [(directory, '', root_matchers)]
+        while pending_dirs:
+            dir_path, rel_prefix, matchers = pending_dirs.pop()
+            if nested_gitignore and rel_prefix:
+                nested_matcher = load_ignore_matcher(dir_path)
+                if nested_matcher is not None:
+                    matchers = matchers + ((len(rel_prefix), nested_matcher),)
+            try:
+                entries = os.scandir(dir_path)
+            except OSError as e:
+                # Like os.walk, skip directories that cannot be listed or have vanished
+                logging.warning(f"Skipping directory {dir_path}: {e}")
+                continue
+            with entries:
+                for entry in entries:
+                    rel_path = rel_prefix + entry.name
+                    if entry.is_dir(follow_symlinks=False):
+                        # Prune ignored directories instead of walking into them
+                        rel_dir = rel_path + os.sep
+                        if not is_ignored(rel_dir, matchers):
+                            pending_dirs.append((entry.path, rel_dir, matchers))
+                    elif (entry.is_file() and not is_binary_filename(entry.name)
+                          and not is_ignored(rel_path, matchers)):
+                        yield entry.path
     else:
-        for file in os.listdir(directory):
-            file_path = os.path.join(directory, file)
-            if os.path.isfile(file_path) and not is_ignored(file_path):
-                yield file_path
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if (entry.is_file() and not is_binary_filename(entry.name)
+                        and not is_ignored(entry.name, root_matchers)):
+                    yield entry.path
 
 #SECTION: Argument Parsing Function
+def positive_int(value):
+    """
+    Parse a command-line value as an integer of at least 1.
+    
+    Args:
+    value (str): The raw argument value.
+    
+    Returns:
+    int: The parsed value.
+    
+    Raises:
+    argparse.ArgumentTypeError: If the value is not an integer of at least 1.
+    """
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid int value: '{value}'")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
+
 def parse_arguments():
     """
     Parse command-line arguments.
@@ -100,9 +337,37 @@ def parse_arguments():
     parser.add_argument("-r", "--recursive", action="store_true", help="Recursively process subdirectories")
     parser.add_argument("-d", "--directory", default=".", help="Source directory to process")
     parser.add_argument("--ignore-gitignore", action="store_true", help="Ignore .gitignore file")
+    parser.add_argument("--force", action="store_true", help="Ignore cached sections and re-read every file")
+    parser.add_argument("-j", "--jobs", type=positive_int, default=None, help="Number of files to read in parallel (use 1 on spinning disks)")
     return parser.parse_args()
 
 #SECTION: User Interaction Functions
+def get_user_choice(filename):
+    """
+    Ask the user whether to include a file, offering shortcuts for the remaining files.
+    
+    Besides yes/no, the user can answer 'a' to include this and every remaining
+    file, or 'q' to stop selecting files.
+    
+    Args:
+    filename (str): The name of the file to confirm.
+    
+    Returns:
+    str: One of 'y' (include), 'n' (skip), 'a' (include all remaining) or 'q' (quit).
+    """
+    while True:
+        response = input(f"Include '{filename}' in the output? (y/n/a/q): ").lower().strip()
+        if response in ['y', 'yes']:
+            return 'y'
+        elif response in ['n', 'no']:
+            return 'n'
+        elif response in ['a', 'all']:
+            return 'a'
+        elif response in ['q', 'quit']:
+            return 'q'
+        else:
+            print("Invalid input. Please enter 'y' for yes, 'n' for no, 'a' for all remaining files or 'q' to quit.")
+
 def get_user_confirmation(filename):
     """
     Ask the user if they want to include a file in the output.
@@ -123,6 +388,8 @@ def get_user_confirmation(filename):
             print("Invalid input. Please enter 'y' for yes or 'n' for no.")
 
 #SECTION: Table of Contents Generation
+_SLUG_TABLE = str.maketrans({' ': '-', '.': None})
+
 def generate_toc(files):
     """
     Generate a table of contents in Markdown format.
@@ -133,15 +400,30 @@ def generate_toc(files):
     Returns:
     str: A Markdown-formatted table of contents.
     """
-    toc = "# Table of Contents\n\n"
-    for file in files:
-        # Create a link-friendly version of the filename
-        link = file.replace(' ', '-').replace('.', '')
-        toc += f"- [{file}](#{link})\n"
-    toc += "\n"  # Add an extra newline for separation
-    return toc
+    # Create link-friendly versions of the filenames in a single pass each
+    entries = ''.join(f"- [{file}](#{file.translate(_SLUG_TABLE)})\n" for file in files)
+    return f"# Table of Contents\n\n{entries}\n"  # Extra newline for separation
 
 #SECTION: Language Identification
+LANGUAGE_MAP = {
+    'py': 'python',
+    'js': 'javascript',
+    'html': 'html',
+    'css': 'css',
+    'java': 'java',
+    'c': 'c',
+    'cpp': 'cpp',
+    'md': 'markdown',
+    'txt': 'text',
+    'json': 'json',
+    'xml': 'xml',
+    'sql': 'sql',
+    'sh': 'bash',
+    'yaml': 'yaml',
+    'yml': 'yaml',
+    # Add more mappings as needed
+}
+
 def get_language_identifier(filename):
     """
     Determine the programming language based on the file extension.
@@ -152,26 +434,8 @@ def get_language_identifier(filename):
     Returns:
     str: A language identifier for Markdown code blocks.
     """
-    extension = filename.split('.')[-1].lower()
-    language_map = {
-        'py': 'python',
-        'js': 'javascript',
-        'html': 'html',
-        'css': 'css',
-        'java': 'java',
-        'c': 'c',
-        'cpp': 'cpp',
-        'md': 'markdown',
-        'txt': 'text',
-        'json': 'json',
-        'xml': 'xml',
-        'sql': 'sql',
-        'sh': 'bash',
-        'yaml': 'yaml',
-        'yml': 'yaml',
-        # Add more mappings as needed
-    }
-    return language_map.get(extension, '')  # Return empty string if extension not found
+    extension = os.path.splitext(filename)[1][1:].lower()
+    return LANGUAGE_MAP.get(extension, '')  # Return empty string if extension not found
 
 #SECTION: Metadata
 def generate_metadata():
@@ -179,8 +443,164 @@ def generate_metadata():
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     return f"Generated on: {timestamp}\n"
 
+#SECTION: Section Rendering and Cache
+def render_section(filename, content):
+    """
+    Render the Markdown section for a single file.
+    
+    Args:
+    filename (str): The name of the file, used as the section heading.
+    content (bytes): The raw file content.
+    
+    Returns:
+    bytes: The UTF-8 encoded heading and fenced code block.
+    """
+    lang_identifier = get_language_identifier(filename)
+    header = f"### {filename}\n```{lang_identifier}\n".encode('utf-8')
+    return b''.join((header, content, b"\n```\n\n"))
+
+def get_cache_path(directory):
+    """
+    Return the section cache location for a source directory.
+    
+    The cache lives under the user cache directory ($XDG_CACHE_HOME, or ~/.cache),
+    never inside the source tree, with one database per absolute source path.
+    
+    Args:
+    directory (str): The source directory.
+    
+    Returns:
+    str: The path of the SQLite database holding the cached sections.
+    """
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    digest = hashlib.sha1(os.fsencode(os.path.abspath(directory))).hexdigest()[:16]
+    return os.path.join(cache_home, 'code2md', f'{digest}.sqlite3')
+
+# Seconds to wait for another run's lock on the cache before giving up on the cache
+CACHE_TIMEOUT = 1.0
+
+class SectionCache:
+    """
+    On-disk cache of rendered sections, keyed by filename and validated by (mtime_ns, size).
+    
+    Every write is committed immediately, so no lock is held across prompts. Any
+    SQLite error (a read-only home directory, a database locked by another run)
+    logs a warning and turns the cache off for the rest of the run, so a cache
+    problem only costs the cache, not the run.
+    """
+    def __init__(self, cache_path):
+        self.connection = None
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            # Autocommit mode, so each statement is its own short transaction
+            self.connection = sqlite3.connect(cache_path, timeout=CACHE_TIMEOUT, isolation_level=None)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS sections "
+                "(filename TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, section BLOB)")
+        except (OSError, sqlite3.Error) as e:
+            self._disable(f"Unable to open cache {cache_path}", e)
+
+    def _disable(self, message, error):
+        logging.warning(f"{message}, continuing without it: {error}")
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except sqlite3.Error:
+                pass
+            self.connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def get(self, filename, signature):
+        """Return the cached section for filename if its (mtime_ns, size) still match, else None."""
+        if self.connection is None:
+            return None
+        try:
+            row = self.connection.execute(
+                "SELECT mtime_ns, size, section FROM sections WHERE filename = ?", (filename,)).fetchone()
+        except sqlite3.Error as e:
+            self._disable("Unable to read cache", e)
+            return None
+        if row is None or tuple(row[:2]) != signature:
+            return None
+        return row[2]
+
+    def put(self, filename, signature, section):
+        """Store the rendered section for filename under its (mtime_ns, size) signature."""
+        if self.connection is None:
+            return
+        try:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO sections VALUES (?, ?, ?, ?)", (filename,) + signature + (section,))
+        except sqlite3.Error as e:
+            self._disable("Unable to update cache", e)
+
+    def prune(self, filenames):
+        """Drop entries for files that were not seen in this run."""
+        if self.connection is None:
+            return
+        keep = set(filenames)
+        try:
+            stale = [(name,) for (name,) in self.connection.execute("SELECT filename FROM sections")
+                     if name not in keep]
+            if stale:
+                self.connection.execute("BEGIN")
+                self.connection.executemany("DELETE FROM sections WHERE filename = ?", stale)
+                self.connection.execute("COMMIT")
+        except sqlite3.Error as e:
+            self._disable("Unable to prune cache", e)
+
+    def close(self):
+        """Close the database."""
+        if self.connection is None:
+            return
+        try:
+            self.connection.close()
+        except sqlite3.Error as e:
+            logging.warning(f"Unable to close cache: {e}")
+        self.connection = None
+
+def _write_section(entry, body, cache):
+    """
+    Write one pending section, waiting for its read if it is not cached.
+    
+    Args:
+    entry (tuple): (filename, signature, cached section or None, read future or None).
+    body (file): The binary file the section is written to.
+    cache (SectionCache): The section cache, updated with freshly rendered sections.
+    
+    Returns:
+    bool: True if the section was written, False if the file was skipped.
+    """
+    filename, signature, section, read = entry
+    if section is None:
+        _, content = read.result()
+        if content is None:
+            logging.error(f"Skipping file {filename}: Unable to read file: {filename}")
+            return False
+        if is_binary_content(content):
+            logging.warning(f"Skipping binary file {filename}")
+            return False
+        section = render_section(filename, content)
+        if signature is not None:
+            cache.put(filename, signature, section)
+    body.write(section)
+    return True
+
+def _is_section_ready(entry):
+    """Check whether a pending section can be written without blocking."""
+    return entry[2] is not None or entry[3].done()
+
 #SECTION: Main Function
-def combine_files_to_markdown(output_file='combined_files.md', include_all=False, directory='.', recursive=False, ignore_gitignore=False):
+# Upper bound on selected files whose contents may be held in memory at once
+MAX_PENDING_SECTIONS = 64
+
+def combine_files_to_markdown(output_file='combined_files.md', include_all=False, directory='.', recursive=False, ignore_gitignore=False, jobs=None, force=False):
     """
     Combine user-selected files into a single Markdown file.
     
@@ -190,44 +610,81 @@ def combine_files_to_markdown(output_file='combined_files.md', include_all=False
     directory (str): Source directory to process.
     recursive (bool): If True, recursively process subdirectories.
     ignore_gitignore (bool): If True, ignore .gitignore file.
+    jobs (int): Number of files to read in parallel; defaults to a pool sized from the CPU count.
+    force (bool): If True, ignore cached sections and re-read every file.
     
     Raises:
     Exception: If an error occurs during file combination.
     """
     try:
         ignore_patterns = None if ignore_gitignore else parse_gitignore(directory)
-        files = collect_files(directory, recursive, ignore_patterns)
         script_name = os.path.basename(__file__)
-        files = [f for f in files if os.path.basename(f) != script_name and os.path.abspath(f) != os.path.abspath(output_file)]
-        
-        files_to_include = []
-        for filename in files:
-            if include_all or get_user_confirmation(filename):
-                files_to_include.append(filename)
+        output_path = os.path.abspath(output_file)
         
-        with open(output_file, 'w') as outfile:
-            # Write metadata
-            outfile.write("# File Combination Metadata\n")
-            outfile.write("```\n")
-            outfile.write(generate_metadata())
-            outfile.write("```\n\n")
-            
-            # Write table of contents
-            outfile.write(generate_toc(files_to_include))
+        # Reads are submitted as soon as a file is selected, so they overlap with
+        # the directory walk and with any prompts. Finished sections are drained in
+        # input order into a spool file while discovery continues, and at most
+        # MAX_PENDING_SECTIONS are in flight, so memory stays bounded by that window.
+        # Unchanged files are served from the section cache without being read.
+        max_workers = jobs if jobs is not None else min(32, (os.cpu_count() or 1) * 4)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor, \
+                SectionCache(get_cache_path(directory)) as cache, \
+                tempfile.TemporaryFile(dir=os.path.dirname(output_path)) as body:
+            # On Windows TemporaryFile is a named file, which the walk could otherwise find
+            spool_path = os.path.abspath(body.name) if isinstance(body.name, str) else None
+            files = []
+            files_written = []
+            pending = deque()
+            stopped_early = False
+            for filename in collect_files(directory, recursive, ignore_patterns, nested_gitignore=not ignore_gitignore):
+                if os.path.basename(filename) == script_name or os.path.abspath(filename) in (output_path, spool_path):
+                    continue
+                if not include_all:
+                    choice = get_user_choice(filename)
+                    if choice == 'q':
+                        stopped_early = True
+                        break
+                    if choice == 'a':
+                        include_all = True
+                files.append(filename)
+                if include_all or choice == 'y':
+                    try:
+                        stat = os.stat(filename)
+                        signature = (stat.st_mtime_ns, stat.st_size)
+                    except OSError:
+                        signature = None  # The read below reports the error
+                    cached = None if force or signature is None else cache.get(filename, signature)
+                    if cached is not None:
+                        pending.append((filename, signature, cached, None))
+                    else:
+                        pending.append((filename, signature, None, executor.submit(_safe_read, filename)))
+                    while pending and (len(pending) >= MAX_PENDING_SECTIONS or _is_section_ready(pending[0])):
+                        entry = pending.popleft()
+                        if _write_section(entry, body, cache):
+                            files_written.append(entry[0])
+            while pending:
+                entry = pending.popleft()
+                if _write_section(entry, body, cache):
+                    files_written.append(entry[0])
+            if not stopped_early:
+                # Only a full walk knows which files are gone for good
+                cache.prune(files)
             
-            # Write file contents
-            for filename in files_to_include:
-                try:
-                    content = read_file_content(filename)
-                    lang_identifier = get_language_identifier(filename)
-                    outfile.write(f"### {filename}\n")
-                    outfile.write(f"```{lang_identifier}\n")
-                    outfile.write(content)
-                    outfile.write("\n```\n\n")
-                except FileProcessingError as e:
-                    logging.error(f"Skipping file {filename}: {str(e)}")
+            # The table of contents lists only the sections actually written; it precedes
+            # them, so it is written first and the spooled sections are copied after it.
+            # File contents are passed through as bytes; only the framing text is encoded.
+            with open(output_file, 'wb', buffering=1 << 20) as outfile:
+                preamble = [
+                    "# File Combination Metadata\n```\n",
+                    generate_metadata(),
+                    "```\n\n",
+                    generate_toc(files_written),
+                ]
+                outfile.write(''.join(preamble).encode('utf-8'))
+                body.seek(0)
+                shutil.copyfileobj(body, outfile, 1 << 20)
         
-        logging.info(f"Successfully combined {len(files_to_include)} out of {len(files)} files into {output_file}")
+        logging.info(f"Successfully combined {len(files_written)} out of {len(files)} files into {output_file}")
     except Exception as e:
         logging.error(f"An error occurred while combining files: {str(e)}")
         raise
@@ -236,7 +693,7 @@ def combine_files_to_markdown(output_file='combined_files.md', include_all=False
 if __name__ == "__main__":
     try:
         args = parse_arguments()
-        combine_files_to_markdown(args.output, args.all, args.directory, args.recursive, args.ignore_gitignore)
+        combine_files_to_markdown(args.output, args.all, args.directory, args.recursive, args.ignore_gitignore, args.jobs, args.force)
     except Exception as e:
         logging.error(f"An error occurred: {str(e)}")
         exit(1)
\ No newline at end of file
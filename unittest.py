@@ -2,14 +2,25 @@
 import os
 import unittest
 import tempfile
+from unittest import mock
+import argparse
+import fnmatch
+import sqlite3
 import shutil
-from code2md import parse_gitignore, collect_files, get_language_identifier
+import code2md
+from code2md import parse_gitignore, compile_ignore_patterns, build_ignore_matcher, collect_files, generate_toc, get_language_identifier, combine_files_to_markdown, read_file_content, positive_int, get_cache_path, get_user_confirmation
 
 class TestFileCombiner(unittest.TestCase):
     def setUp(self):
         # Create a temporary directory
         self.test_dir = tempfile.mkdtemp()
 
+        # Keep the section cache out of the user's home directory
+        self.cache_home = tempfile.mkdtemp()
+        env_patcher = mock.patch.dict(os.environ, {"XDG_CACHE_HOME": self.cache_home})
+        env_patcher.start()
+        self.addCleanup(env_patcher.stop)
+
         # Create some test files
         self.create_test_file("test1.py", "print('Hello')")
         self.create_test_file("test2.js", "console.log('World')")
@@ -17,13 +28,45 @@ class TestFileCombiner(unittest.TestCase):
         self.create_test_file("ignored.log", "This should be ignored")
 
     def tearDown(self):
-        # Remove the directory after the test
+        # Remove the directories after the test
         shutil.rmtree(self.test_dir)
+        shutil.rmtree(self.cache_home)
 
     def create_test_file(self, filename, content):
         with open(os.path.join(self.test_dir, filename), 'w') as f:
             f.write(content)
 
+    def test_read_file_content_handles_short_reads(self):
+        real_read = os.read
+        # Simulate a filesystem that returns at most 4 bytes per read(2)
+        with mock.patch("code2md.os.read", side_effect=lambda fd, n: real_read(fd, min(n, 4))):
+            content = read_file_content(os.path.join(self.test_dir, "test2.js"))
+        self.assertEqual(content, b"console.log('World')")
+
+    def test_read_file_content_small_file_takes_one_read(self):
+        real_read = os.read
+        requests = []
+
+        def read(fd, n):
+            requests.append(n)
+            return real_read(fd, n)
+
+        with mock.patch("code2md.os.read", side_effect=read):
+            content = read_file_content(os.path.join(self.test_dir, "test1.py"))
+        self.assertEqual(content, b"print('Hello')")
+        self.assertEqual(requests, [len(content) + 1])
+
+    def test_read_file_content_handles_file_grown_after_fstat(self):
+        real_fstat = os.fstat
+
+        def fstat(fd):
+            # Report the size from before the last 10 bytes were appended
+            return mock.Mock(st_size=real_fstat(fd).st_size - 10)
+
+        with mock.patch("code2md.os.fstat", side_effect=fstat):
+            content = read_file_content(os.path.join(self.test_dir, "test2.js"))
+        self.assertEqual(content, b"console.log('World')")
+
     def test_parse_gitignore(self):
         patterns = parse_gitignore(self.test_dir)
         self.assertEqual(patterns, ["*.log"])
@@ -34,6 +77,290 @@ class TestFileCombiner(unittest.TestCase):
         self.assertIn(os.path.join(self.test_dir, "test2.js"), files)
         self.assertNotIn(os.path.join(self.test_dir, "ignored.log"), files)
 
+    def test_collect_files_skips_unreadable_directories(self):
+        os.makedirs(os.path.join(self.test_dir, "locked"))
+        os.makedirs(os.path.join(self.test_dir, "open"))
+        self.create_test_file(os.path.join("locked", "secret.py"), "")
+        self.create_test_file(os.path.join("open", "main.py"), "")
+        real_scandir = os.scandir
+
+        def scandir(path):
+            if os.path.basename(path) == "locked":
+                raise PermissionError(13, "Permission denied", path)
+            return real_scandir(path)
+
+        with mock.patch("code2md.os.scandir", side_effect=scandir):
+            files = list(collect_files(self.test_dir, recursive=True))
+        self.assertIn(os.path.join(self.test_dir, "open", "main.py"), files)
+        self.assertNotIn(os.path.join(self.test_dir, "locked", "secret.py"), files)
+
+    def test_collect_files_prunes_ignored_directories(self):
+        os.makedirs(os.path.join(self.test_dir, "node_modules", "pkg"))
+        os.makedirs(os.path.join(self.test_dir, "src"))
+        self.create_test_file(os.path.join("node_modules", "pkg", "index.js"), "")
+        self.create_test_file(os.path.join("src", "main.py"), "")
+        self.create_test_file(os.path.join("src", "debug.log"), "")
+        files = list(collect_files(self.test_dir, recursive=True, ignore_patterns=["*.log", "node_modules/"]))
+        self.assertIn(os.path.join(self.test_dir, "src", "main.py"), files)
+        self.assertNotIn(os.path.join(self.test_dir, "src", "debug.log"), files)
+        self.assertNotIn(os.path.join(self.test_dir, "node_modules", "pkg", "index.js"), files)
+
+    def test_collect_files_nested_gitignore(self):
+        os.makedirs(os.path.join(self.test_dir, "docs"))
+        self.create_test_file(os.path.join("docs", ".gitignore"), "*.txt")
+        self.create_test_file(os.path.join("docs", "notes.txt"), "")
+        self.create_test_file("readme.txt", "")
+        files = list(collect_files(self.test_dir, recursive=True, nested_gitignore=True))
+        self.assertIn(os.path.join(self.test_dir, "readme.txt"), files)
+        self.assertNotIn(os.path.join(self.test_dir, "docs", "notes.txt"), files)
+
+    def test_collect_files_skips_binary_extensions(self):
+        self.create_test_file("logo.PNG", "")
+        files = list(collect_files(self.test_dir))
+        self.assertNotIn(os.path.join(self.test_dir, "logo.PNG"), files)
+        self.assertIn(os.path.join(self.test_dir, "test1.py"), files)
+
+    def test_collect_files_prunes_nested_directories_without_pathspec(self):
+        os.makedirs(os.path.join(self.test_dir, "src", "node_modules", "pkg"))
+        self.create_test_file(os.path.join("src", "node_modules", "pkg", "index.js"), "")
+        self.create_test_file(os.path.join("src", "main.py"), "")
+        with mock.patch.object(code2md, "pathspec", None):
+            matcher = build_ignore_matcher(["node_modules/"])
+            self.assertTrue(matcher("node_modules" + os.sep))
+            self.assertTrue(matcher(os.path.join("src", "node_modules") + os.sep))
+            self.assertFalse(matcher(os.path.join("src", "node_modules")))
+            files = list(collect_files(self.test_dir, recursive=True, ignore_patterns=["node_modules/"]))
+        self.assertIn(os.path.join(self.test_dir, "src", "main.py"), files)
+        self.assertNotIn(os.path.join(self.test_dir, "src", "node_modules", "pkg", "index.js"), files)
+
+    def test_collect_files_rereads_nested_gitignore(self):
+        os.makedirs(os.path.join(self.test_dir, "docs"))
+        self.create_test_file(os.path.join("docs", "notes.txt"), "")
+        self.create_test_file(os.path.join("docs", ".gitignore"), "*.md")
+        notes = os.path.join(self.test_dir, "docs", "notes.txt")
+        self.assertIn(notes, list(collect_files(self.test_dir, recursive=True, nested_gitignore=True)))
+        self.create_test_file(os.path.join("docs", ".gitignore"), "*.txt")
+        self.assertNotIn(notes, list(collect_files(self.test_dir, recursive=True, nested_gitignore=True)))
+
+    @unittest.skipIf(code2md.pathspec is None, "pathspec is not installed")
+    def test_collect_files_nested_negation_reincludes(self):
+        os.makedirs(os.path.join(self.test_dir, "logs"))
+        self.create_test_file(os.path.join("logs", ".gitignore"), "!keep.log")
+        self.create_test_file(os.path.join("logs", "keep.log"), "")
+        self.create_test_file(os.path.join("logs", "drop.log"), "")
+        files = list(collect_files(self.test_dir, recursive=True,
+                                   ignore_patterns=parse_gitignore(self.test_dir), nested_gitignore=True))
+        self.assertIn(os.path.join(self.test_dir, "logs", "keep.log"), files)
+        self.assertNotIn(os.path.join(self.test_dir, "logs", "drop.log"), files)
+
+    def test_combine_files_skips_binary_content(self):
+        self.create_test_file("blob.dat", "abc\0def")
+        output_file = os.path.join(self.test_dir, "out.md")
+        with self.assertLogs(level="INFO") as logs:
+            combine_files_to_markdown(output_file, include_all=True, directory=self.test_dir)
+        with open(output_file, 'rb') as f:
+            output = f.read()
+        self.assertNotIn(b"blob.dat", output)
+        self.assertIn(b"- [" + os.path.join(self.test_dir, "test1.py").encode(), output)
+        self.assertTrue(any("Successfully combined 3 out of 4 files" in line for line in logs.output))
+
+    def test_build_ignore_matcher_fallback_matches_fnmatch(self):
+        patterns = ["*.log", "build", "a/b", "*.py[cod]"]
+        paths = ["debug.log", os.path.join("sub", "debug.log"), "debug.log.txt",
+                 "build", os.path.join("sub", "build"), "builder",
+                 os.path.join("a", "b"), os.path.join("x", "a", "b"), "b",
+                 "mod.pyc", os.path.join("pkg", "mod.pyo"), "mod.py", "test1.py"]
+        with mock.patch.object(code2md, "pathspec", None):
+            matcher = build_ignore_matcher(patterns)
+        for path in paths:
+            expected = any(fnmatch.fnmatch(path, pattern) or
+                           fnmatch.fnmatch(os.path.basename(path), pattern)
+                           for pattern in patterns)
+            self.assertEqual(bool(matcher(path)), expected, path)
+
+    def test_compile_ignore_patterns(self):
+        self.assertIsNone(compile_ignore_patterns([]))
+        regex = compile_ignore_patterns(["*.log", "build"])
+        self.assertTrue(regex.match("debug.log"))
+        self.assertTrue(regex.match("build"))
+        self.assertFalse(regex.match("test1.py"))
+
+    @unittest.skipIf(code2md.pathspec is None, "pathspec is not installed")
+    def test_build_ignore_matcher_gitignore_semantics(self):
+        matcher = build_ignore_matcher(["*.log", "!keep.log", "/root.txt"])
+        self.assertTrue(matcher("debug.log"))
+        self.assertFalse(matcher("keep.log"))
+        self.assertTrue(matcher("root.txt"))
+        self.assertFalse(matcher(os.path.join("sub", "root.txt")))
+
+    def test_generate_toc(self):
+        toc = generate_toc(["my file.py", "test2.js"])
+        self.assertEqual(toc, "# Table of Contents\n\n"
+                              "- [my file.py](#my-filepy)\n"
+                              "- [test2.js](#test2js)\n\n")
+
+    def combine_and_track_reads(self, **kwargs):
+        output_file = os.path.join(self.test_dir, "out.md")
+        with mock.patch("code2md.read_file_content", wraps=code2md.read_file_content) as reader:
+            combine_files_to_markdown(output_file, include_all=True, directory=self.test_dir, **kwargs)
+        with open(output_file, 'rb') as f:
+            output = f.read()
+        return output, sorted(call.args[0] for call in reader.call_args_list)
+
+    def test_combine_files_cache_hit_skips_read(self):
+        first_output, first_reads = self.combine_and_track_reads()
+        self.assertEqual(len(first_reads), 3)
+        self.assertTrue(get_cache_path(self.test_dir).startswith(self.cache_home))
+        self.assertFalse(any(name.startswith(".code2md") for name in os.listdir(self.test_dir)))
+        output, reads = self.combine_and_track_reads()
+        self.assertEqual(reads, [])
+        self.assertIn(b"```python\nprint('Hello')\n```", output)
+        self.assertEqual(output.split(b"```\n\n", 1)[1], first_output.split(b"```\n\n", 1)[1])
+
+    def test_combine_files_cache_rereads_changed_files(self):
+        self.combine_and_track_reads()
+        test1 = os.path.join(self.test_dir, "test1.py")
+        test2 = os.path.join(self.test_dir, "test2.js")
+        self.create_test_file("test1.py", "print('Hello again')")
+        stat = os.stat(test2)
+        os.utime(test2, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+        output, reads = self.combine_and_track_reads()
+        self.assertEqual(reads, sorted([test1, test2]))
+        self.assertIn(b"print('Hello again')", output)
+
+    def test_combine_files_force_bypasses_cache(self):
+        self.combine_and_track_reads()
+        _, reads = self.combine_and_track_reads(force=True)
+        self.assertEqual(len(reads), 3)
+
+    def test_combine_files_survives_locked_cache(self):
+        self.combine_and_track_reads()
+        self.create_test_file("test1.py", "print('Hello again')")
+        # Another run holding the write lock must only cost this run the cache
+        blocker = sqlite3.connect(get_cache_path(self.test_dir), isolation_level=None)
+        try:
+            blocker.execute("BEGIN IMMEDIATE")
+            with mock.patch.object(code2md, "CACHE_TIMEOUT", 0.05), \
+                    self.assertLogs(level="WARNING") as logs:
+                output, reads = self.combine_and_track_reads()
+            blocker.execute("ROLLBACK")
+        finally:
+            blocker.close()
+        self.assertIn(os.path.join(self.test_dir, "test1.py"), reads)
+        self.assertIn(b"print('Hello again')", output)
+        self.assertEqual(output.count(b"\n### "), 3)
+        self.assertTrue(any("Unable to update cache" in line for line in logs.output))
+
+    def test_combine_files_holds_no_cache_lock_while_prompting(self):
+        self.combine_and_track_reads()
+        self.create_test_file("test1.py", "print('Hello again')")
+        lock_results = []
+
+        def answer(prompt):
+            # While the user is being asked, another run must be able to write
+            other = sqlite3.connect(get_cache_path(self.test_dir), timeout=0, isolation_level=None)
+            try:
+                other.execute("BEGIN IMMEDIATE")
+                other.execute("COMMIT")
+                lock_results.append(True)
+            finally:
+                other.close()
+            return "y"
+
+        output_file = os.path.join(self.test_dir, "out.md")
+        with mock.patch("builtins.input", side_effect=answer):
+            combine_files_to_markdown(output_file, directory=self.test_dir)
+        self.assertEqual(lock_results, [True] * 3)
+
+    def test_combine_files_prunes_deleted_files_from_cache(self):
+        self.combine_and_track_reads()
+        os.remove(os.path.join(self.test_dir, "test2.js"))
+        self.combine_and_track_reads()
+        connection = sqlite3.connect(get_cache_path(self.test_dir))
+        try:
+            cached = sorted(name for (name,) in connection.execute("SELECT filename FROM sections"))
+        finally:
+            connection.close()
+        self.assertEqual(cached, sorted(os.path.join(self.test_dir, name) for name in (".gitignore", "test1.py")))
+
+    def combine_with_answers(self, answers):
+        output_file = os.path.join(self.test_dir, "out.md")
+        with mock.patch("builtins.input", side_effect=answers) as prompt, \
+                mock.patch("builtins.print") as printer:
+            combine_files_to_markdown(output_file, directory=self.test_dir)
+        with open(output_file, 'rb') as f:
+            output = f.read()
+        return output, prompt.call_count, printer
+
+    def test_combine_files_answer_all_includes_remaining_files(self):
+        output, prompts, _ = self.combine_with_answers(["a"])
+        self.assertEqual(prompts, 1)
+        self.assertEqual(output.count(b"\n### "), 3)
+
+    def test_combine_files_answer_quit_stops_selection(self):
+        output, prompts, _ = self.combine_with_answers(["y", "q"])
+        self.assertEqual(prompts, 2)
+        self.assertEqual(output.count(b"\n### "), 1)
+        self.assertEqual(output.count(b"\n- ["), 1)
+
+    def test_combine_files_invalid_answer_reprompts(self):
+        output, prompts, printer = self.combine_with_answers(["maybe", "y", "n", "n"])
+        self.assertEqual(prompts, 4)
+        self.assertIn("Invalid input", printer.call_args.args[0])
+        self.assertEqual(output.count(b"\n### "), 1)
+
+    def test_get_user_confirmation(self):
+        with mock.patch("builtins.input", side_effect=["y", "a", "n"]) as prompt, \
+                mock.patch("builtins.print") as printer:
+            self.assertEqual([get_user_confirmation("f") for _ in range(2)], [True, False])
+        self.assertEqual(prompt.call_count, 3)
+        self.assertIn("(y/n)", prompt.call_args.args[0])
+        printer.assert_called_once_with("Invalid input. Please enter 'y' for yes or 'n' for no.")
+
+    def test_positive_int(self):
+        self.assertEqual(positive_int("4"), 4)
+        for value in ("0", "-1", "x"):
+            with self.assertRaises(argparse.ArgumentTypeError):
+                positive_int(value)
+
+    def test_combine_files_with_small_read_window(self):
+        source_dir = os.path.join(self.test_dir, "many")
+        os.makedirs(source_dir)
+        names = [f"f{i:02d}.txt" for i in range(10)]
+        for name in names:
+            self.create_test_file(os.path.join("many", name), name)
+        output_file = os.path.join(self.test_dir, "out.md")
+        with mock.patch.object(code2md, "MAX_PENDING_SECTIONS", 2):
+            combine_files_to_markdown(output_file, include_all=True, directory=source_dir, jobs=2)
+        with open(output_file, 'rb') as f:
+            output = f.read()
+        body = output[output.index(b"### "):]
+        for name in names:
+            self.assertEqual(body.count(f"```text\n{name}\n```".encode()), 1)
+        # Sections follow the table of contents order
+        toc_order = [line[3:line.index("]")] for line in output.decode().splitlines() if line.startswith("- [")]
+        section_order = [line[4:] for line in body.decode().splitlines() if line.startswith("### ")]
+        self.assertEqual(toc_order, section_order)
+
+    def test_combine_files_skips_named_spool_file(self):
+        # Emulate Windows, where TemporaryFile creates a visible named file
+        spools = []
+
+        def named_spool(**kwargs):
+            spool = tempfile.NamedTemporaryFile(**kwargs)
+            spools.append(os.path.basename(spool.name))
+            return spool
+
+        output_file = os.path.join(self.test_dir, "out.md")
+        with mock.patch("code2md.tempfile.TemporaryFile", side_effect=named_spool), \
+                self.assertLogs(level="INFO") as logs:
+            combine_files_to_markdown(output_file, include_all=True, directory=self.test_dir)
+        with open(output_file, 'rb') as f:
+            output = f.read()
+        self.assertEqual(len(spools), 1)
+        self.assertNotIn(spools[0].encode(), output)
+        self.assertTrue(any("Successfully combined 3 out of 3 files" in line for line in logs.output))
+
     def test_get_language_identifier(self):
         self.assertEqual(get_language_identifier("test.py"), "python")
         self.assertEqual(get_language_identifier("test.js"), "javascript")